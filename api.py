@@ -9,39 +9,240 @@ envia webhooks para notificar sobre o status do processamento.
 
 import os
 import json
+import time
+import queue
+import atexit
 import logging
-import requests
+from contextlib import asynccontextmanager
+import httpx
+import orjson
+import redis
+import redis.asyncio
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
 from pathlib import Path
-from dotenv import load_dotenv
-from fastapi import FastAPI, BackgroundTasks, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Request
 from pydantic import BaseModel
 import uvicorn
+from celery import current_task
+from celery.signals import worker_init, worker_process_init
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as TaskPoolPrefork
 
 # Importar o módulo principal
+import sb_connect
 from main import processar_ortomosaico
-
-# Carregar variáveis de ambiente
-load_dotenv()
+from tarefas import celery_app, FILA_WEBHOOKS
+from config import obter_configuracoes
 
 # Configuração de logging global
-# Mover para cá garante que o logger seja configurado quando o módulo é importado
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(str(Path("/root/processamento_ortomosaicos/logs/api.log"))),
-        logging.StreamHandler() # Mantém o log no console também
-    ]
-)
+# Mover para cá garante que o logger seja configurado quando o módulo é importado.
+# Os registros são apenas enfileirados pelo root logger; a escrita em disco e no
+# console é feita por uma thread dedicada (ver iniciar_logging).
+def _obter_fila_de_log(fila=None):
+    """
+    Retorna a fila do QueueHandler do root logger, instalando-o se necessário.
+    
+    Em `python api.py` o arquivo é carregado duas vezes no mesmo processo
+    (como __main__ e como api); as duas cópias precisam usar a mesma fila,
+    senão os registros ficam presos na fila da cópia que não é consumida.
+    
+    Args:
+        fila (queue.Queue, opcional): Fila a usar se o handler for instalado
+    """
+    raiz = logging.getLogger()
+    for handler in raiz.handlers:
+        if isinstance(handler, QueueHandler):
+            return handler.queue
+    
+    if fila is None:
+        fila = queue.Queue(-1)
+    handler = QueueHandler(fila)
+    # O QueueHandler grava apenas a mensagem; o formato completo é aplicado uma
+    # única vez, pelos handlers da thread de logging
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    raiz.addHandler(handler)
+    raiz.setLevel(logging.INFO)
+    return fila
+
+log_q = _obter_fila_de_log()
+
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Vários processos (workers do gunicorn e do Celery) escrevem no mesmo arquivo,
+# sempre em modo append. A rotação é feita externamente (logrotate); o
+# WatchedFileHandler reabre o arquivo quando ele é rotacionado.
+_log_handlers = [
+    WatchedFileHandler(
+        str(Path("/root/processamento_ortomosaicos/logs/api.log")),
+        delay=True
+    ),
+    logging.StreamHandler() # Mantém o log no console também
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+_log_listener = None
+_log_listener_pid = None
+
+def iniciar_logging():
+    """
+    Inicia a thread que grava os registros de log enfileirados.
+    
+    Deve ser chamada uma vez em cada processo (inclusive após um fork),
+    já que threads não são herdadas pelos processos filhos.
+    """
+    global _log_listener, _log_listener_pid
+    if _log_listener_pid == os.getpid():
+        return
+    
+    # Voltar a enfileirar os registros, caso o processo tenha sido criado por
+    # um processo que gravava diretamente (ver gravar_logs_diretamente)
+    raiz = logging.getLogger()
+    for handler in _log_handlers:
+        raiz.removeHandler(handler)
+    fila = _obter_fila_de_log(log_q)
+    
+    _log_listener = QueueListener(fila, *_log_handlers, respect_handler_level=True)
+    _log_listener.start()
+    _log_listener_pid = os.getpid()
+
+def parar_logging():
+    """Grava os registros pendentes e encerra a thread de logging."""
+    global _log_listener, _log_listener_pid
+    if _log_listener is not None and _log_listener_pid == os.getpid():
+        _log_listener.stop()
+    _log_listener = None
+    _log_listener_pid = None
+
+atexit.register(parar_logging)
+
+def gravar_logs_diretamente():
+    """
+    Faz o processo gravar os logs diretamente, sem a thread de logging.
+    
+    Usada no processo principal do worker Celery com pool prefork, que não
+    deve ter threads em execução ao criar os processos filhos. Os registros
+    já enfileirados são gravados antes, para que os filhos recebam a fila
+    vazia e não os gravem de novo.
+    """
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        if isinstance(handler, QueueHandler):
+            raiz.removeHandler(handler)
+    
+    while True:
+        try:
+            registro = log_q.get_nowait()
+        except queue.Empty:
+            break
+        for handler in _log_handlers:
+            handler.handle(registro)
+    
+    for handler in _log_handlers:
+        raiz.addHandler(handler)
+
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Inicializa e encerra os recursos de cada processo do servidor.
+    
+    Na inicialização, valida as configurações, inicia a gravação dos logs e
+    cria o cliente Supabase, para que a primeira requisição não pague o custo
+    da conexão. No encerramento, fecha as conexões e grava os logs pendentes.
+    """
+    iniciar_logging()
+    
+    # Falhar já na inicialização se as credenciais estiverem ausentes
+    configuracoes = obter_configuracoes()
+    logger.info(f"Configurações: SUPABASE_URL=configurado, SUPABASE_KEY=configurado, "
+                f"WEBHOOK_URL={'configurado' if configuracoes.webhook_url else 'não configurado'}")
+    
+    app.state.sb = await sb_connect.conectar_async()
+    
+    try:
+        yield
+    finally:
+        await sb_connect.fechar_async()
+        await _redis_async.aclose()
+        parar_logging()
+
 # Criar aplicação FastAPI
 app = FastAPI(
     title="API de Processamento de Ortomosaicos",
     description="API para processamento de ortomosaicos agrícolas",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+def obter_supabase(request: Request):
+    """Retorna o cliente Supabase criado na inicialização do servidor."""
+    return request.app.state.sb
+
+@worker_init.connect
+def configurar_logging_worker(sender=None, **kwargs):
+    """
+    Configura os logs no processo principal do worker Celery.
+    
+    Com o pool prefork, a thread de logging é iniciada apenas nos processos
+    filhos (ver iniciar_logging_worker): uma thread em execução no momento do
+    fork pode deixar a trava da fila presa nos filhos. Nos pools que executam
+    as tarefas no próprio processo (solo, threads), ela é iniciada aqui.
+    """
+    if issubclass(get_implementation(sender.pool_cls), TaskPoolPrefork):
+        gravar_logs_diretamente()
+    else:
+        iniciar_logging()
+
+@worker_process_init.connect
+def iniciar_logging_worker(**kwargs):
+    """Inicia a gravação dos logs em cada processo filho do worker Celery."""
+    iniciar_logging()
+
+# Cliente HTTP reutilizado por todos os webhooks (mantém as conexões abertas entre chamadas)
+_WEBHOOK_HTTP = httpx.Client(
+    timeout=10,
+    transport=httpx.HTTPTransport(
+        limits=httpx.Limits(max_keepalive_connections=10),
+        retries=2
+    )
+)
+atexit.register(_WEBHOOK_HTTP.close)
+
+# Cache de status no Redis, evitando consultar o Supabase a cada verificação de status.
+# O cliente síncrono é usado pelos workers; o assíncrono, pelas rotas da API.
+# Timeouts curtos: com o Redis fora do ar, o status deixa de ser atualizado,
+# mas o processamento e as rotas não ficam bloqueados.
+REDIS_TIMEOUT = 2
+_redis = redis.Redis.from_url(
+    obter_configuracoes().redis_url,
+    socket_connect_timeout=REDIS_TIMEOUT,
+    socket_timeout=REDIS_TIMEOUT
+)
+_redis_async = redis.asyncio.from_url(
+    obter_configuracoes().redis_url,
+    socket_connect_timeout=REDIS_TIMEOUT,
+    socket_timeout=REDIS_TIMEOUT
 )
 
+# Validade do status obtido consultando os produtos finais no Supabase. Os
+# status informados pelo processamento não expiram: cada novo processamento
+# sobrescreve o anterior, começando por 'enfileirado'.
+TTL_STATUS_CONSULTA = 15
+
+def _chave_status(id_projeto):
+    """Retorna a chave do Redis com o último status do projeto."""
+    return f"status:{id_projeto}"
+
+def _status_json(id_projeto, id_talhao, status, mensagem=None):
+    """Serializa o status de um projeto no formato guardado no Redis."""
+    return json.dumps({
+        "id_projeto": id_projeto,
+        "id_talhao": id_talhao,
+        "status": status,
+        "mensagem": mensagem
+    })
+
 # Modelos de dados
 class ProcessamentoRequest(BaseModel):
     id_projeto: str
@@ -54,7 +255,7 @@ class ProcessamentoResponse(BaseModel):
     mensagem: str = None
 
 # Função para enviar webhook
-def enviar_webhook(id_projeto, id_talhao, status, mensagem=None):
+def enviar_webhook(id_projeto, id_talhao, status, mensagem=None, sequencia=None):
     """
     Envia uma notificação webhook sobre o status do processamento.
     
@@ -63,8 +264,13 @@ def enviar_webhook(id_projeto, id_talhao, status, mensagem=None):
         id_talhao (str): ID do talhão
         status (str): Status do processamento ('iniciado', 'concluido', 'erro')
         mensagem (str, opcional): Mensagem adicional, especialmente útil para erros
+        sequencia (int, opcional): Momento em que o status foi gerado, em
+            nanossegundos; se omitido, usa o momento do envio
+        
+    Raises:
+        httpx.HTTPError: Se o receptor estiver indisponível ou responder com erro 5xx
     """
-    webhook_url = os.getenv("WEBHOOK_URL")
+    webhook_url = obter_configuracoes().webhook_url
     if not webhook_url:
         logger.warning("URL de webhook não configurada. Notificação não enviada.")
         return
@@ -72,73 +278,166 @@ def enviar_webhook(id_projeto, id_talhao, status, mensagem=None):
     payload = {
         "id_projeto": id_projeto,
         "id_talhao": id_talhao,
-        "status": status
+        "status": status,
+        "sequencia": sequencia if sequencia is not None else time.time_ns()
     }
     
     if mensagem:
         payload["mensagem"] = mensagem
     
     try:
-        response = requests.post(
+        response = _WEBHOOK_HTTP.post(
             webhook_url,
-            json=payload,
+            content=orjson.dumps(payload),
             headers={"Content-Type": "application/json"}
         )
-        
-        if response.status_code >= 200 and response.status_code < 300:
-            logger.info(f"Webhook enviado com sucesso: {status}")
-        else:
-            logger.error(f"Falha ao enviar webhook: {response.status_code} - {response.text}")
     
-    except Exception as e:
+    except httpx.HTTPError as e:
         logger.error(f"Erro ao enviar webhook: {str(e)}")
+        raise
+    
+    if response.status_code >= 200 and response.status_code < 300:
+        logger.info(f"Webhook enviado com sucesso: {status}")
+    elif response.status_code >= 500:
+        logger.warning(f"Receptor do webhook indisponível: {response.status_code} - {response.text}")
+        response.raise_for_status()
+    else:
+        logger.error(f"Falha ao enviar webhook: {response.status_code} - {response.text}")
+
+# Tarefa Celery que envia o webhook fora do fluxo de processamento
+@celery_app.task(
+    ignore_result=True,
+    autoretry_for=(httpx.HTTPError,),
+    retry_backoff=True,
+    max_retries=5,
+    name="enviar_webhook"
+)
+def enviar_webhook_task(id_projeto, id_talhao, status, mensagem=None, sequencia=None):
+    """Envia o webhook, sendo reenfileirada com backoff exponencial em caso de falha."""
+    enviar_webhook(id_projeto, id_talhao, status, mensagem, sequencia)
+
+def notificar_status(id_projeto, id_talhao, status, mensagem=None):
+    """
+    Enfileira o envio de um webhook de status, sem aguardar o receptor.
+    
+    Fora de um worker Celery (por exemplo, em `python main.py`), onde não há
+    garantia de um worker consumindo a fila de webhooks, o envio é feito
+    diretamente.
+    
+    Como cada webhook é reenviado de forma independente em caso de falha, eles
+    podem chegar fora de ordem. O campo 'sequencia', gerado aqui, permite ao
+    receptor descartar um status mais antigo que o último recebido.
+    
+    Args:
+        id_projeto (str): ID do projeto
+        id_talhao (str): ID do talhão
+        status (str): Status do processamento ('iniciado', 'concluido', 'erro')
+        mensagem (str, opcional): Mensagem adicional, especialmente útil para erros
+    """
+    # Atualizar o cache consultado pela rota de status
+    try:
+        _redis.set(_chave_status(id_projeto), _status_json(id_projeto, id_talhao, status, mensagem))
+    except redis.RedisError as e:
+        logger.warning(f"Erro ao atualizar cache de status do projeto {id_projeto}: {str(e)}")
+    
+    sequencia = time.time_ns()
+    
+    if not current_task:
+        try:
+            enviar_webhook(id_projeto, id_talhao, status, mensagem, sequencia)
+        except httpx.HTTPError as e:
+            logger.error(f"Erro ao enviar webhook '{status}': {str(e)}")
+        return
+    
+    try:
+        enviar_webhook_task.apply_async(
+            args=[id_projeto, id_talhao, status, mensagem, sequencia],
+            queue=FILA_WEBHOOKS
+        )
+    except Exception as e:
+        logger.error(f"Erro ao enfileirar webhook '{status}': {str(e)}")
 
 # Função para executar processamento em background
-def executar_processamento_background(id_projeto, id_talhao):
-    """Executa o processamento em background e envia webhooks."""
+def executar_processamento_background(id_projeto, id_talhao, notificar_inicio=True):
+    """
+    Executa o processamento em background.
+    
+    Args:
+        id_projeto (str): ID do projeto
+        id_talhao (str): ID do talhão
+        notificar_inicio (bool, opcional): Enviar o webhook de início (apenas
+            na primeira tentativa, para não repeti-lo a cada nova tentativa)
+        
+    Raises:
+        Exception: Se ocorrer um erro no processamento
+    """
     logger.info(f"Iniciando processamento em background para projeto {id_projeto}, talhão {id_talhao}")
     try:
-        # Verificar variáveis de ambiente
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_KEY")
-        webhook_url = os.getenv("WEBHOOK_URL")
-        
-        logger.info(f"Configurações: SUPABASE_URL={'configurado' if supabase_url else 'não configurado'}, "
-                   f"SUPABASE_KEY={'configurado' if supabase_key else 'não configurado'}, "
-                   f"WEBHOOK_URL={'configurado' if webhook_url else 'não configurado'}")
-        
-        if not all([supabase_url, supabase_key]):
-            raise ValueError("Credenciais do Supabase não configuradas")
+        # Verificar configurações (lidas uma única vez por processo)
+        obter_configuracoes()
         
         # Notificar início
-        logger.info("Enviando webhook de início")
-        enviar_webhook(id_projeto, id_talhao, "iniciado")
+        if notificar_inicio:
+            logger.info("Enfileirando webhook de início")
+            notificar_status(id_projeto, id_talhao, "iniciado")
         
         # Executar processamento
         logger.info("Iniciando função de processamento")
-        sucesso = processar_ortomosaico(id_projeto, id_talhao)
-        logger.info(f"Processamento concluído com sucesso: {sucesso}")
+        processar_ortomosaico(id_projeto, id_talhao)
+        logger.info("Processamento concluído com sucesso")
         
     except Exception as e:
         logger.error(f"Erro no processamento background: {str(e)}", exc_info=True)
-        try:
-            enviar_webhook(id_projeto, id_talhao, "erro", mensagem=str(e))
-        except Exception as webhook_error:
-            logger.error(f"Erro ao enviar webhook de erro: {str(webhook_error)}")
-        raise  # Re-lança a exceção para garantir que ela seja registrada pelo FastAPI
+        raise  # Re-lança a exceção para que o Celery registre a falha ou tente novamente
+
+# Tarefa Celery que executa o processamento nos workers
+@celery_app.task(bind=True, max_retries=3, acks_late=True, name="processar_ortomosaico")
+def processar_ortomosaico_task(self, id_projeto, id_talhao):
+    """
+    Tarefa Celery que executa o processamento de um ortomosaico.
+    
+    Dados de entrada inválidos (ValueError, por exemplo um polígono ou uma
+    grade vazios, ou um ortomosaico com bandas insuficientes) fazem a tarefa
+    falhar imediatamente; os demais erros fazem a tarefa ser reenfileirada
+    até o limite de tentativas. Os webhooks de início e de erro são enviados
+    uma única vez: o de início na primeira tentativa e o de erro quando a
+    tarefa falha definitivamente.
+    
+    Args:
+        id_projeto (str): ID do projeto
+        id_talhao (str): ID do talhão
+    """
+    primeira_tentativa = self.request.retries == 0
+    
+    try:
+        executar_processamento_background(id_projeto, id_talhao, notificar_inicio=primeira_tentativa)
+    
+    except ValueError as e:
+        # Dados de entrada inválidos (polígono, grade ou ortomosaico):
+        # não adianta tentar novamente
+        notificar_status(id_projeto, id_talhao, "erro", mensagem=str(e))
+        raise
+    
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            logger.error(f"Processamento do projeto {id_projeto} falhou após {self.request.retries + 1} tentativas")
+            notificar_status(id_projeto, id_talhao, "erro", mensagem=str(e))
+            raise
+        
+        logger.warning(f"Tentativa {self.request.retries + 1} falhou para projeto {id_projeto}: {str(e)}")
+        raise self.retry(exc=e, countdown=60)
 
 # Rotas da API
 @app.post("/processar", response_model=ProcessamentoResponse)
-async def iniciar_processamento(
-    request: ProcessamentoRequest,
-    background_tasks: BackgroundTasks
-):
+async def iniciar_processamento(request: ProcessamentoRequest):
     """
     Inicia o processamento de um ortomosaico.
     
+    O processamento é enfileirado no Redis e executado pelos workers Celery,
+    de forma que a API responde imediatamente.
+    
     Args:
         request: Objeto com id_projeto e id_talhao
-        background_tasks: Objeto para execução em background
         
     Returns:
         Resposta com status inicial
@@ -148,12 +447,24 @@ async def iniciar_processamento(
         if not request.id_projeto or not request.id_talhao:
             raise HTTPException(status_code=400, detail="ID de projeto e talhão são obrigatórios")
         
-        # Iniciar processamento em background
-        background_tasks.add_task(
-            executar_processamento_background,
-            request.id_projeto,
-            request.id_talhao
-        )
+        # Registrar o novo processamento antes de enfileirá-lo, substituindo o
+        # status de processamentos anteriores do projeto
+        chave = _chave_status(request.id_projeto)
+        try:
+            await _redis_async.set(chave, _status_json(request.id_projeto, request.id_talhao, "enfileirado"))
+        except redis.RedisError as e:
+            logger.warning(f"Erro ao atualizar cache de status do projeto {request.id_projeto}: {str(e)}")
+        
+        # Enfileirar processamento para os workers
+        try:
+            tarefa = processar_ortomosaico_task.delay(request.id_projeto, request.id_talhao)
+        except Exception:
+            try:
+                await _redis_async.delete(chave)
+            except redis.RedisError:
+                pass
+            raise
+        logger.info(f"Processamento enfileirado: tarefa {tarefa.id}")
         
         return {
             "id_projeto": request.id_projeto,
@@ -167,33 +478,68 @@ async def iniciar_processamento(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/status/{id_projeto}")
-async def verificar_status(id_projeto: str):
+async def verificar_status(id_projeto: str, client=Depends(obter_supabase)):
     """
     Verifica o status de processamento de um projeto.
     
-    Esta é uma implementação básica que pode ser expandida para
-    verificar o status real do processamento em um sistema de filas.
+    O status é lido do Redis, atualizado quando o processamento é enfileirado
+    e a cada notificação do processamento. Sem status registrado (projetos
+    processados antes do cache existir), o projeto é considerado concluído
+    se o relatório, último produto enviado pelo processamento, estiver
+    disponível no bucket de produtos finais.
     
     Args:
         id_projeto: ID do projeto
+        client: Cliente Supabase assíncrono, criado na inicialização do servidor
         
     Returns:
         Status do processamento
     """
-    # Implementação básica - em um sistema real, verificaria o status em um banco de dados
-    # ou sistema de filas
-    return {
-        "id_projeto": id_projeto,
-        "status": "em_processamento",
-        "mensagem": "Verificação de status real não implementada nesta versão"
-    }
+    try:
+        em_cache = await _redis_async.get(_chave_status(id_projeto))
+        if em_cache is not None:
+            return json.loads(em_cache)
+    except redis.RedisError as e:
+        logger.warning(f"Erro ao consultar cache de status do projeto {id_projeto}: {str(e)}")
+    
+    try:
+        arquivos = await sb_connect.listar_arquivos_async(client, "produtos_finais", prefixo=id_projeto)
+    
+    except Exception as e:
+        logger.error(f"Erro ao verificar status do projeto {id_projeto}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if any(arquivo.get("name") == "relatorio.pdf" for arquivo in arquivos):
+        resposta = {
+            "id_projeto": id_projeto,
+            "status": "concluido",
+            "mensagem": "Produtos finais disponíveis"
+        }
+    else:
+        resposta = {
+            "id_projeto": id_projeto,
+            "status": "nao_encontrado",
+            "mensagem": "Nenhum processamento registrado para o projeto"
+        }
+    
+    # Guardar por alguns segundos, para que consultas repetidas não cheguem ao Supabase
+    try:
+        await _redis_async.set(_chave_status(id_projeto), json.dumps(resposta), ex=TTL_STATUS_CONSULTA, nx=True)
+    except redis.RedisError as e:
+        logger.warning(f"Erro ao atualizar cache de status do projeto {id_projeto}: {str(e)}")
+    
+    return resposta
 
-# Ponto de entrada para execução direta
+# Ponto de entrada para execução direta (desenvolvimento)
+# Em produção, usar: gunicorn -c gunicorn_conf.py api:app
 if __name__ == "__main__":
-    # Iniciar servidor
+    # Iniciar servidor (recarregamento automático apenas se API_RELOAD=1).
+    # O recarregamento exige a referência "api:app"; sem ele, a própria
+    # aplicação é passada, evitando carregar este arquivo uma segunda vez.
+    recarregar = os.getenv("API_RELOAD") == "1"
     uvicorn.run(
-        "api:app",
+        "api:app" if recarregar else app,
         host="0.0.0.0",
         port=8000,
-        reload=True
+        reload=recarregar
     )
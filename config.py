@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Módulo de configuração do sistema de processamento de ortomosaicos.
+
+Este módulo lê e valida as variáveis de ambiente uma única vez por processo,
+disponibilizando-as para os demais módulos.
+"""
+
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from dotenv import load_dotenv
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """Configurações do sistema, lidas do ambiente ou do arquivo .env."""
+    supabase_url: str
+    supabase_key: str
+    webhook_url: str | None = None
+    redis_url: str = "redis://localhost:6379/0"
+
+@lru_cache(maxsize=None)
+def obter_configuracoes():
+    """
+    Retorna as configurações do sistema.
+    
+    As variáveis de ambiente são lidas apenas na primeira chamada; as
+    seguintes reutilizam o mesmo objeto.
+    
+    Returns:
+        Settings: Configurações validadas
+    
+    Raises:
+        ValueError: Se as credenciais do Supabase não estiverem configuradas
+    """
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_KEY")
+
+    if not supabase_url or not supabase_key:
+        raise ValueError("Credenciais do Supabase não configuradas no arquivo .env")
+
+    return Settings(
+        supabase_url=supabase_url,
+        supabase_key=supabase_key,
+        webhook_url=os.getenv("WEBHOOK_URL") or None,
+        redis_url=os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    )
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Configuração do gunicorn para execução da API em produção.
+
+Uso:
+    gunicorn -c gunicorn_conf.py api:app
+"""
+
+import os
+import multiprocessing
+
+bind = os.getenv("API_BIND", "0.0.0.0:8000")
+
+# Um processo por núcleo (mais folga para I/O), cada um com seu event loop uvicorn
+workers = int(os.getenv("API_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Carregar a aplicação antes do fork, compartilhando a memória entre os workers.
+# Threads e conexões são criadas depois, na inicialização de cada worker.
+preload_app = True
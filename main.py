@@ -38,7 +38,11 @@ def processar_ortomosaico(id_projeto, id_talhao):
         id_talhao (str): Identificador único do talhão
         
     Returns:
-        bool: True se o processamento foi concluído com sucesso, False caso contrário
+        bool: True se o processamento foi concluído com sucesso
+        
+    Raises:
+        Exception: Se ocorrer um erro em qualquer etapa do processamento. A
+            notificação de erro fica a cargo de quem chamou a função.
     """
     logger = logging.getLogger(__name__)
     logger.info(f"Iniciando processamento do projeto {id_projeto}, talhão {id_talhao}")
@@ -101,18 +105,15 @@ def processar_ortomosaico(id_projeto, id_talhao):
         
         # Notificar conclusão via webhook
         logger.info("Notificando conclusão via webhook")
-        from api import enviar_webhook
-        enviar_webhook(id_projeto, id_talhao, "concluido")
+        from api import notificar_status
+        notificar_status(id_projeto, id_talhao, "concluido")
         
         logger.info(f"Processamento do projeto {id_projeto} concluído com sucesso")
         return True
         
     except Exception as e:
         logger.error(f"Erro no processamento: {str(e)}", exc_info=True)
-        # Notificar erro via webhook
-        from api import enviar_webhook
-        enviar_webhook(id_projeto, id_talhao, "erro", mensagem=str(e))
-        return False
+        raise
     
     finally:
         # Limpar arquivos temporários se necessário
@@ -125,7 +126,9 @@ if __name__ == "__main__":
     # Carregar variáveis de ambiente
     load_dotenv()
     
-    # Configurar logging
+    # Configurar logging (a mesma configuração usada pela API e pelos workers)
+    from api import iniciar_logging
+    iniciar_logging()
     logger = logging.getLogger(__name__)
     
     # Verificar argumentos da linha de comando
@@ -137,7 +140,12 @@ if __name__ == "__main__":
     id_talhao = sys.argv[2]
     
     # Executar processamento
-    sucesso = processar_ortomosaico(id_projeto, id_talhao)
+    try:
+        processar_ortomosaico(id_projeto, id_talhao)
+    except Exception as e:
+        # Notificar erro via webhook
+        from api import notificar_status
+        notificar_status(id_projeto, id_talhao, "erro", mensagem=str(e))
+        sys.exit(1)
     
-    # Sair com código apropriado
-    sys.exit(0 if sucesso else 1)
+    sys.exit(0)
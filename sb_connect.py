@@ -8,59 +8,213 @@ recuperação de arquivos nos buckets.
 """
 
 import os
+import time
+import base64
+import asyncio
 import logging
+import threading
+from itertools import groupby
+from urllib.parse import quote
 from pathlib import Path
-from dotenv import load_dotenv
 import supabase
 import httpx
-from supabase.lib.client_options import ClientOptions
+import zstandard
+from supabase.lib.client_options import AsyncClientOptions, SyncClientOptions
+from storage3.types import CreateSignedUploadUrlOptions
+
+from config import obter_configuracoes
 
 # Configuração de logging
 logger = logging.getLogger(__name__)
 
+# Cliente compartilhado pelo processo, reaproveitando o pool de conexões do httpx
+_client_singleton = None
+_http_client = None
+_lock = threading.Lock()
+
+# Cliente assíncrono compartilhado, usado pelas rotas da API
+_async_client_singleton = None
+_async_http_client = None
+_async_lock = asyncio.Lock()
+
+def _limites_pool():
+    """Retorna os limites do pool de conexões com o Supabase."""
+    return httpx.Limits(
+        max_connections=120,
+        max_keepalive_connections=80,
+        keepalive_expiry=30
+    )
+
+def _criar_http_client():
+    """
+    Cria o cliente httpx usado por todos os serviços do Supabase.
+    
+    Os limites do pool são definidos no transport para que sejam de fato
+    aplicados, e o HTTP/2 é habilitado para multiplexar as requisições.
+    
+    Returns:
+        httpx.Client: Cliente HTTP configurado
+    """
+    transport = httpx.HTTPTransport(
+        limits=_limites_pool(),
+        retries=1,
+        http2=True
+    )
+    # Timeouts de leitura e escrita longos para uploads e downloads grandes (10 minutos)
+    return httpx.Client(
+        transport=transport,
+        timeout=httpx.Timeout(connect=10, read=600, write=600, pool=30),
+        follow_redirects=True
+    )
+
 def conectar():
     """
     Estabelece conexão com o Supabase.
     
+    O cliente é criado apenas na primeira chamada e reutilizado nas seguintes.
+    As credenciais são lidas uma única vez por processo (ver config); para
+    trocá-las é preciso reiniciar o processo.
+    
     Returns:
         objeto de cliente Supabase
     
     Raises:
         Exception: Se não for possível conectar ao Supabase
     """
-    # Carregar variáveis de ambiente se ainda não foram carregadas
-    if not os.getenv("SUPABASE_URL"):
-        load_dotenv()
+    global _client_singleton, _http_client
+    
+    if _client_singleton is not None:
+        return _client_singleton
+    
+    with _lock:
+        # Verificar novamente, outra thread pode ter criado o cliente enquanto aguardávamos
+        if _client_singleton is not None:
+            return _client_singleton
+        
+        configuracoes = obter_configuracoes()
+        url = configuracoes.supabase_url
+        key = configuracoes.supabase_key
+        
+        try:
+            http_client = _criar_http_client()
+            client_options = SyncClientOptions(httpx_client=http_client)
+            client = supabase.create_client(
+                url, 
+                key,
+                options=client_options
+            )
+            logger.info("Conexão com Supabase estabelecida com sucesso (pool HTTP/2 compartilhado)")
+        
+        except Exception as e:
+            logger.error(f"Erro ao conectar com Supabase: {str(e)}")
+            raise
+        
+        _client_singleton = client
+        _http_client = http_client
+        return client
+
+def fechar():
+    """
+    Encerra o cliente Supabase compartilhado e fecha o pool de conexões.
+    """
+    global _client_singleton, _http_client
     
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_KEY")
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+            logger.info("Pool de conexões com o Supabase encerrado")
+        
+        _client_singleton = None
+        _http_client = None
+
+async def conectar_async():
+    """
+    Estabelece conexão assíncrona com o Supabase, para uso nas rotas da API.
     
-    if not url or not key:
-        raise ValueError("Credenciais do Supabase não configuradas no arquivo .env")
+    Assim como em conectar(), o cliente é criado apenas na primeira chamada
+    e reutilizado nas seguintes.
     
-    try:
-        # Definir timeout mais longo para uploads grandes (5 minutos)
-        client_options = ClientOptions(storage_client_timeout=300)
-        client = supabase.create_client(
-            url, 
-            key,
-            options=client_options
-        )
-        logger.info("Conexão com Supabase estabelecida com sucesso (timeout de storage aumentado)")
+    Returns:
+        objeto de cliente Supabase assíncrono
+    
+    Raises:
+        Exception: Se não for possível conectar ao Supabase
+    """
+    global _async_client_singleton, _async_http_client
+    
+    if _async_client_singleton is not None:
+        return _async_client_singleton
+    
+    async with _async_lock:
+        if _async_client_singleton is not None:
+            return _async_client_singleton
+        
+        configuracoes = obter_configuracoes()
+        
+        try:
+            http_client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(
+                    limits=_limites_pool(),
+                    retries=1,
+                    http2=True
+                ),
+                timeout=httpx.Timeout(connect=10, read=60, write=60, pool=30),
+                follow_redirects=True
+            )
+            client = await supabase.acreate_client(
+                configuracoes.supabase_url,
+                configuracoes.supabase_key,
+                options=AsyncClientOptions(httpx_client=http_client)
+            )
+            logger.info("Conexão assíncrona com Supabase estabelecida com sucesso")
+        
+        except Exception as e:
+            logger.error(f"Erro ao conectar com Supabase: {str(e)}")
+            raise
+        
+        _async_client_singleton = client
+        _async_http_client = http_client
         return client
+
+async def fechar_async():
+    """
+    Encerra o cliente Supabase assíncrono e fecha o pool de conexões.
+    """
+    global _async_client_singleton, _async_http_client
     
-    except Exception as e:
-        logger.error(f"Erro ao conectar com Supabase: {str(e)}")
-        raise
+    async with _async_lock:
+        if _async_http_client is not None:
+            await _async_http_client.aclose()
+            logger.info("Pool de conexões assíncronas com o Supabase encerrado")
+        
+        _async_client_singleton = None
+        _async_http_client = None
+
+# Limite de operações simultâneas de storage por processo, para não esgotar as conexões da API
+MAX_STORAGE_CONCURRENCY = int(os.getenv("MAX_STORAGE_CONCURRENCY", "10"))
+_STORAGE_SEM = threading.BoundedSemaphore(MAX_STORAGE_CONCURRENCY)
+_STORAGE_SEM_ASYNC = asyncio.BoundedSemaphore(MAX_STORAGE_CONCURRENCY)
+
+# Tamanho dos blocos gravados em disco durante os downloads (16 MB)
+TAMANHO_BLOCO_DOWNLOAD = 16 * 1024 * 1024
 
-def baixar_arquivo(client, caminho_bucket, caminho_local):
+def _http(client):
+    """Retorna o cliente httpx compartilhado pelo cliente Supabase."""
+    return client.options.httpx_client
+
+def baixar_arquivo(client, caminho_bucket, caminho_local, descomprimir=False):
     """
     Baixa um arquivo do bucket do Supabase.
     
+    O download é feito em blocos a partir de uma URL assinada, de modo que o
+    uso de memória não cresce com o tamanho do arquivo.
+    
     Args:
         client: Cliente Supabase
         caminho_bucket (str): Caminho do arquivo no bucket
         caminho_local (Path): Caminho local onde o arquivo será salvo
+        descomprimir (bool, opcional): Se o arquivo foi enviado comprimido com zstd
+            (ver enviar_arquivo) e deve ser descomprimido ao ser salvo
         
     Returns:
         Path: Caminho do arquivo baixado
@@ -79,12 +233,29 @@ def baixar_arquivo(client, caminho_bucket, caminho_local):
         # Garantir que o diretório de destino exista
         caminho_local.parent.mkdir(parents=True, exist_ok=True)
         
-        # Baixar o arquivo
-        response = client.storage.from_(bucket).download(caminho_arquivo)
+        with _STORAGE_SEM:
+            # Gerar URL assinada para o download
+            signed_url = client.storage.from_(bucket).create_signed_url(caminho_arquivo, 3600)["signedURL"]
         
-        # Salvar o arquivo localmente
-        with open(caminho_local, 'wb') as f:
-            f.write(response)
+            # Baixar o arquivo em blocos, salvando-o localmente. A resposta é pedida sem
+            # compressão para que os bytes brutos possam ir direto para o disco, e o
+            # arquivo é aberto sem buffer para evitar uma cópia extra em memória.
+            with _http(client).stream(
+                "GET",
+                signed_url,
+                headers={"Accept-Encoding": "identity"},
+                timeout=httpx.Timeout(10, read=None)
+            ) as response:
+                response.raise_for_status()
+                descompressor = zstandard.ZstdDecompressor().decompressobj() if descomprimir else None
+                with open(caminho_local, 'wb', buffering=0) as f:
+                    for bloco in response.iter_raw(chunk_size=TAMANHO_BLOCO_DOWNLOAD):
+                        if descompressor is not None:
+                            bloco = descompressor.decompress(bloco)
+                        # Escrita sem buffer pode ser parcial; repetir até gravar o bloco inteiro
+                        restante = memoryview(bloco)
+                        while restante:
+                            restante = restante[f.write(restante):]
         
         logger.info(f"Arquivo baixado com sucesso para {caminho_local}")
         return caminho_local
@@ -93,14 +264,195 @@ def baixar_arquivo(client, caminho_bucket, caminho_local):
         logger.error(f"Erro ao baixar arquivo {caminho_bucket}: {str(e)}")
         raise
 
-def enviar_arquivo(client, caminho_local, caminho_bucket):
+# Tamanho dos blocos do upload resumível. Não é configurável: o endpoint TUS do
+# Supabase exige blocos de exatamente 6 MB.
+TAMANHO_BLOCO_UPLOAD = 6 * 1024 * 1024
+
+# Timeout de cada bloco enviado no upload resumível
+TIMEOUT_BLOCO_UPLOAD = httpx.Timeout(10, read=120, write=120, pool=30)
+
+# Número de falhas consecutivas toleradas antes de abortar o upload
+MAX_TENTATIVAS_BLOCO = 5
+
+def _url_storage(client, caminho):
+    """
+    Monta a URL de um endpoint da API de storage do Supabase.
+    
+    O atributo supabase_url do cliente é uma str ou um yarl.URL, conforme a
+    versão da biblioteca; por isso a URL é montada a partir do texto.
+    """
+    return f"{str(client.supabase_url).rstrip('/')}/storage/v1/{caminho}"
+
+def _timeout_upload(tamanho):
+    """Calcula o tempo total permitido para um upload (mínimo de 5 minutos, ~3 min/GB)."""
+    return max(300, tamanho / (5 * 1024 * 1024))
+
+def _offset_confirmado(http, url_upload, headers, offset_atual):
+    """Consulta o servidor TUS pelo último offset recebido, mantendo o atual em caso de falha."""
+    try:
+        response = http.head(url_upload, headers=headers, timeout=TIMEOUT_BLOCO_UPLOAD)
+        response.raise_for_status()
+        return int(response.headers["Upload-Offset"])
+    except (httpx.HTTPError, KeyError, ValueError) as e:
+        logger.warning(f"Não foi possível consultar o offset do upload: {str(e)}")
+        return offset_atual
+
+def _enviar_resumable(client, caminho_local, bucket, caminho_arquivo, content_type="application/octet-stream"):
+    """
+    Envia um arquivo pelo endpoint de upload resumível (TUS) do Supabase.
+    
+    O arquivo é enviado em blocos. Em caso de falha de rede, o envio é
+    retomado a partir do último offset confirmado pelo servidor, em vez de
+    recomeçar do início.
+    
+    Args:
+        client: Cliente Supabase
+        caminho_local (Path): Caminho local do arquivo
+        bucket (str): Nome do bucket
+        caminho_arquivo (str): Caminho de destino dentro do bucket
+        content_type (str, opcional): Tipo do conteúdo do arquivo
+        
+    Raises:
+        TimeoutError: Se o upload exceder o tempo total permitido
+    """
+    http = _http(client)
+    tamanho = Path(caminho_local).stat().st_size
+    prazo = time.monotonic() + _timeout_upload(tamanho)
+    
+    headers = {**client.options.headers, "Tus-Resumable": "1.0.0"}
+    metadados = {
+        "bucketName": bucket,
+        "objectName": caminho_arquivo,
+        "contentType": content_type,
+        "cacheControl": "3600"
+    }
+    upload_metadata = ",".join(
+        f"{chave} {base64.b64encode(valor.encode()).decode()}" for chave, valor in metadados.items()
+    )
+    
+    # Criar a sessão de upload
+    response = http.post(
+        _url_storage(client, "upload/resumable"),
+        headers={
+            **headers,
+            "Upload-Length": str(tamanho),
+            "Upload-Metadata": upload_metadata,
+            "x-upsert": "true"
+        },
+        timeout=TIMEOUT_BLOCO_UPLOAD
+    )
+    response.raise_for_status()
+    url_upload = str(response.url.join(response.headers["Location"]))
+    logger.debug(f"Sessão de upload resumível criada: {url_upload}")
+    
+    offset = 0
+    falhas = 0
+    with open(caminho_local, 'rb') as f:
+        while offset < tamanho:
+            if time.monotonic() > prazo:
+                raise TimeoutError(f"Tempo limite excedido no upload de {caminho_local} ({offset}/{tamanho} bytes enviados)")
+            
+            f.seek(offset)
+            bloco = f.read(TAMANHO_BLOCO_UPLOAD)
+            
+            try:
+                response = http.patch(
+                    url_upload,
+                    content=bloco,
+                    headers={
+                        **headers,
+                        "Upload-Offset": str(offset),
+                        "Content-Type": "application/offset+octet-stream"
+                    },
+                    timeout=TIMEOUT_BLOCO_UPLOAD
+                )
+                response.raise_for_status()
+                offset = int(response.headers["Upload-Offset"])
+                falhas = 0
+                logger.debug(f"Upload de {caminho_local}: {offset}/{tamanho} bytes enviados")
+            
+            except httpx.TransportError as e:
+                falhas += 1
+                if falhas > MAX_TENTATIVAS_BLOCO:
+                    raise
+                logger.warning(f"Falha no envio do bloco (offset {offset}): {str(e)}. Retomando upload")
+                offset = _offset_confirmado(http, url_upload, headers, offset)
+
+def _enviar_url_assinada(client, caminho_local, bucket, caminho_arquivo, content_type="application/octet-stream"):
+    """
+    Envia um arquivo por uma URL de upload assinada.
+    
+    Apenas a geração da URL usa as credenciais do Supabase; o conteúdo é
+    enviado em streaming, em um único PUT, pelo pool de conexões compartilhado.
+    
+    Args:
+        client: Cliente Supabase
+        caminho_local (Path): Caminho local do arquivo
+        bucket (str): Nome do bucket
+        caminho_arquivo (str): Caminho de destino dentro do bucket
+        content_type (str, opcional): Tipo do conteúdo do arquivo
+    """
+    assinatura = client.storage.from_(bucket).create_signed_upload_url(
+        caminho_arquivo,
+        CreateSignedUploadUrlOptions(upsert="true")
+    )
+    
+    # A URL devolvida pela biblioteca é relativa em algumas versões (quando o
+    # cliente httpx é injetado); por isso ela é montada a partir do token
+    signed_url = _url_storage(
+        client,
+        f"object/upload/sign/{bucket}/{quote(caminho_arquivo)}?token={quote(assinatura['token'])}"
+    )
+    
+    tamanho = Path(caminho_local).stat().st_size
+    with open(caminho_local, 'rb') as f:
+        response = _http(client).put(
+            signed_url,
+            content=iter(lambda: f.read(TAMANHO_BLOCO_UPLOAD), b""),
+            headers={
+                "Content-Type": content_type,
+                "Content-Length": str(tamanho),
+                "x-upsert": "true"
+            }
+        )
+    response.raise_for_status()
+    logger.debug(f"Upload por URL assinada concluído. Status da resposta: {response.status_code}")
+
+def _comprimir_zstd(caminho_local):
+    """
+    Comprime um arquivo com zstd, gravando o resultado ao lado do original.
+    
+    Args:
+        caminho_local (Path): Caminho local do arquivo
+        
+    Returns:
+        Path: Caminho do arquivo comprimido (extensão .zst)
+    """
+    caminho_comprimido = Path(caminho_local).with_name(Path(caminho_local).name + ".zst")
+    
+    with open(caminho_local, 'rb') as origem, open(caminho_comprimido, 'wb') as destino:
+        zstandard.ZstdCompressor(level=3, threads=-1).copy_stream(origem, destino)
+    
+    tamanho_original = Path(caminho_local).stat().st_size
+    tamanho_comprimido = caminho_comprimido.stat().st_size
+    logger.info(f"Arquivo {caminho_local} comprimido com zstd: {tamanho_original} -> {tamanho_comprimido} bytes")
+    return caminho_comprimido
+
+def enviar_arquivo(client, caminho_local, caminho_bucket, comprimir=False):
     """
     Envia um arquivo para o bucket do Supabase.
     
+    Arquivos maiores que um bloco de upload são enviados pelo endpoint
+    resumível (TUS), em blocos de 6 MB; os menores,
+    por uma URL de upload assinada.
+    
     Args:
         client: Cliente Supabase
         caminho_local (Path): Caminho local do arquivo
         caminho_bucket (str): Caminho de destino no bucket
+        comprimir (bool, opcional): Comprimir o arquivo com zstd antes do envio.
+            Usar apenas quando quem consome o arquivo sabe descomprimi-lo
+            (ver baixar_arquivo)
         
     Returns:
         str: URL público do arquivo (se disponível)
@@ -120,16 +472,25 @@ def enviar_arquivo(client, caminho_local, caminho_bucket):
         if not Path(caminho_local).exists():
             raise FileNotFoundError(f"Arquivo {caminho_local} não encontrado")
         
-        # Ler o arquivo
-        with open(caminho_local, 'rb') as f:
-            # Enviar o arquivo (passando o objeto de arquivo 'f' diretamente)
-            logger.debug(f"Iniciando a chamada client.storage.from_('{bucket}').upload('{caminho_arquivo}') com upsert=true (streaming)...")
-            response = client.storage.from_(bucket).upload(
-                caminho_arquivo,
-                f, # Passar o objeto de arquivo para streaming
-                {"content-type": "application/octet-stream", "upsert": "true"} 
-            )
-            logger.debug(f"Chamada de upload concluída. Status da resposta: {response.status_code if hasattr(response, 'status_code') else 'N/A'}")
+        # Comprimir o arquivo, se solicitado, e enviar a versão comprimida
+        caminho_envio = _comprimir_zstd(caminho_local) if comprimir else Path(caminho_local)
+        content_type = "application/zstd" if comprimir else "application/octet-stream"
+        
+        try:
+            with _STORAGE_SEM:
+                if caminho_envio.stat().st_size > TAMANHO_BLOCO_UPLOAD:
+                    # Arquivos grandes: upload resumível em blocos
+                    logger.debug(f"Iniciando upload resumível de {caminho_envio} em blocos de 6 MB...")
+                    _enviar_resumable(client, caminho_envio, bucket, caminho_arquivo, content_type)
+                else:
+                    # Arquivos pequenos: um único PUT em uma URL de upload assinada
+                    logger.debug(f"Iniciando upload de {caminho_envio} por URL assinada com upsert=true (streaming)...")
+                    _enviar_url_assinada(client, caminho_envio, bucket, caminho_arquivo, content_type)
+        
+        finally:
+            # Remover o arquivo comprimido temporário
+            if comprimir:
+                caminho_envio.unlink(missing_ok=True)
         
         logger.info(f"Arquivo enviado com sucesso para {caminho_bucket}")
         
@@ -147,51 +508,90 @@ def enviar_arquivo(client, caminho_local, caminho_bucket):
         logger.error(f"Erro ao enviar arquivo {caminho_local} para {caminho_bucket}: {str(e)}")
         raise
 
-def listar_arquivos(client, bucket):
+def listar_arquivos(client, bucket, prefixo="", limite=100, offset=0):
     """
     Lista os arquivos em um bucket.
     
     Args:
         client: Cliente Supabase
         bucket (str): Nome do bucket
+        prefixo (str, opcional): Pasta dentro do bucket a ser listada
+        limite (int, opcional): Número máximo de arquivos retornados
+        offset (int, opcional): Número de arquivos a pular, para paginação
         
     Returns:
         list: Lista de arquivos no bucket
     """
     try:
-        logger.info(f"Listando arquivos no bucket {bucket}")
-        response = client.storage.from_(bucket).list()
+        logger.info(f"Listando arquivos no bucket {bucket} (prefixo '{prefixo}', limite {limite}, offset {offset})")
+        response = client.storage.from_(bucket).list(prefixo, {"limit": limite, "offset": offset})
         return response
     
     except Exception as e:
         logger.error(f"Erro ao listar arquivos no bucket {bucket}: {str(e)}")
         raise
 
-def excluir_arquivo(client, caminho_bucket):
+async def listar_arquivos_async(client, bucket, prefixo="", limite=100, offset=0):
     """
-    Exclui um arquivo do bucket.
+    Lista os arquivos em um bucket usando o cliente assíncrono.
     
     Args:
-        client: Cliente Supabase
-        caminho_bucket (str): Caminho do arquivo no bucket
+        client: Cliente Supabase assíncrono
+        bucket (str): Nome do bucket
+        prefixo (str, opcional): Pasta dentro do bucket a ser listada
+        limite (int, opcional): Número máximo de arquivos retornados
+        offset (int, opcional): Número de arquivos a pular, para paginação
         
     Returns:
-        bool: True se o arquivo foi excluído com sucesso
+        list: Lista de arquivos no bucket
     """
     try:
-        # Extrair nome do bucket e caminho do arquivo
-        partes = caminho_bucket.split('/', 1)
-        bucket = partes[0]
-        caminho_arquivo = partes[1] if len(partes) > 1 else ""
+        logger.info(f"Listando arquivos no bucket {bucket} (prefixo '{prefixo}', limite {limite}, offset {offset})")
+        async with _STORAGE_SEM_ASYNC:
+            return await client.storage.from_(bucket).list(prefixo, {"limit": limite, "offset": offset})
+    
+    except Exception as e:
+        logger.error(f"Erro ao listar arquivos no bucket {bucket}: {str(e)}")
+        raise
+
+def excluir_arquivos(client, caminhos_bucket):
+    """
+    Exclui vários arquivos, com uma única requisição por bucket.
+    
+    Args:
+        client: Cliente Supabase
+        caminhos_bucket (list): Caminhos dos arquivos, no formato bucket/caminho
         
-        logger.info(f"Excluindo arquivo {caminho_arquivo} do bucket {bucket}")
+    Returns:
+        bool: True se os arquivos foram excluídos com sucesso
+    """
+    def extrair_bucket(caminho_bucket):
+        return caminho_bucket.split('/', 1)[0]
+    
+    for bucket, caminhos in groupby(sorted(caminhos_bucket, key=extrair_bucket), key=extrair_bucket):
+        # Extrair caminho dos arquivos dentro do bucket
+        caminhos_arquivos = [caminho.split('/', 1)[1] if '/' in caminho else "" for caminho in caminhos]
         
-        # Excluir o arquivo
-        client.storage.from_(bucket).remove([caminho_arquivo])
+        try:
+            logger.info(f"Excluindo {len(caminhos_arquivos)} arquivo(s) do bucket {bucket}")
+            client.storage.from_(bucket).remove(caminhos_arquivos)
+            logger.info(f"Arquivos excluídos com sucesso do bucket {bucket}")
         
-        logger.info(f"Arquivo {caminho_bucket} excluído com sucesso")
-        return True
+        except Exception as e:
+            logger.error(f"Erro ao excluir arquivos do bucket {bucket}: {str(e)}")
+            raise
     
-    except Exception as e:
-        logger.error(f"Erro ao excluir arquivo {caminho_bucket}: {str(e)}")
-        raise
+    return True
+
+def excluir_arquivo(client, caminho_bucket):
+    """
+    Exclui um arquivo do bucket.
+    
+    Args:
+        client: Cliente Supabase
+        caminho_bucket (str): Caminho do arquivo no bucket
+        
+    Returns:
+        bool: True se o arquivo foi excluído com sucesso
+    """
+    return excluir_arquivos(client, [caminho_bucket])
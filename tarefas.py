@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Módulo de configuração da fila de tarefas.
+
+Este módulo define a aplicação Celery usada para executar o processamento
+de ortomosaicos em workers dedicados, utilizando o Redis como broker.
+As tarefas propriamente ditas são registradas no módulo api.
+"""
+
+import logging
+from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
+
+import sb_connect
+from config import obter_configuracoes
+
+logger = logging.getLogger(__name__)
+
+# Fila dedicada para os processamentos longos de ortomosaicos
+FILA_ORTOMOSAICOS = "ortho_q"
+
+# Fila separada para os webhooks, que não devem esperar atrás dos processamentos
+FILA_WEBHOOKS = "webhooks"
+
+# Tempo que o Redis aguarda a confirmação de uma tarefa antes de entregá-la a
+# outro worker. Com task_acks_late, a confirmação só ocorre ao fim do
+# processamento, então o valor precisa ficar acima do processamento mais longo
+# esperado (o padrão do Redis, 1 hora, faria um segundo worker processar o
+# mesmo projeto em paralelo).
+VISIBILITY_TIMEOUT = 12 * 60 * 60
+
+redis_url = obter_configuracoes().redis_url
+
+celery_app = Celery(
+    "ortho",
+    broker=redis_url,
+    backend=redis_url,
+    include=["api"]
+)
+
+celery_app.conf.update(
+    # Confirmar a tarefa somente após a execução, para não perdê-la em caso de queda do worker
+    task_acks_late=True,
+    broker_transport_options={"visibility_timeout": VISIBILITY_TIMEOUT},
+    # Cada worker reserva apenas uma tarefa por vez, já que os processamentos são longos
+    worker_prefetch_multiplier=1,
+    task_default_queue=FILA_ORTOMOSAICOS,
+    task_serializer="json",
+    result_serializer="json",
+    accept_content=["json"],
+    # Manter a configuração de logging da aplicação (ver api.iniciar_logging)
+    worker_hijack_root_logger=False
+)
+
+@worker_process_init.connect
+def inicializar_worker(**kwargs):
+    """Cria o cliente Supabase na inicialização do processo do worker."""
+    try:
+        sb_connect.conectar()
+    except Exception as e:
+        # A conexão será tentada novamente na primeira tarefa
+        logger.warning(f"Não foi possível pré-conectar ao Supabase: {str(e)}")
+
+@worker_process_shutdown.connect
+def finalizar_worker(**kwargs):
+    """Fecha o pool de conexões com o Supabase no encerramento do worker."""
+    sb_connect.fechar()
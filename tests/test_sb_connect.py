@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Testes dos uploads do módulo sb_connect.
+
+Os dois caminhos de upload (URL assinada e resumível/TUS) são exercitados
+com um cliente Supabase real, cujas requisições HTTP são respondidas por um
+servidor simulado (httpx.MockTransport).
+"""
+
+import httpx
+import pytest
+import supabase
+from supabase.lib.client_options import SyncClientOptions
+
+import sb_connect
+
+SUPABASE_URL = "https://projeto.supabase.co"
+SUPABASE_KEY = "cabecalho.payload.assinatura"
+
+class StorageSimulado:
+    """Simula os endpoints de upload da API de storage do Supabase."""
+    
+    def __init__(self):
+        self.objetos = {}
+        self.uploads = {}
+    
+    def __call__(self, request):
+        caminho = request.url.path
+        
+        if request.method == "POST" and caminho.startswith("/storage/v1/object/upload/sign/"):
+            objeto = caminho.removeprefix("/storage/v1/object/upload/sign/")
+            return httpx.Response(200, json={"url": f"/object/upload/sign/{objeto}?token=tok-{objeto}"})
+        
+        if request.method == "PUT" and caminho.startswith("/storage/v1/object/upload/sign/"):
+            objeto = caminho.removeprefix("/storage/v1/object/upload/sign/")
+            assert request.url.params["token"] == f"tok-{objeto}"
+            self.objetos[objeto] = request.read()
+            return httpx.Response(200, json={"Key": objeto})
+        
+        if request.method == "POST" and caminho == "/storage/v1/upload/resumable":
+            assert request.headers["Tus-Resumable"] == "1.0.0"
+            self.uploads["abc"] = {"tamanho": int(request.headers["Upload-Length"]), "dados": bytearray()}
+            return httpx.Response(201, headers={"Location": f"{SUPABASE_URL}/storage/v1/upload/resumable/abc"})
+        
+        if request.method == "PATCH" and caminho == "/storage/v1/upload/resumable/abc":
+            upload = self.uploads["abc"]
+            assert int(request.headers["Upload-Offset"]) == len(upload["dados"])
+            upload["dados"].extend(request.read())
+            return httpx.Response(204, headers={"Upload-Offset": str(len(upload["dados"]))})
+        
+        return httpx.Response(404)
+
+@pytest.fixture
+def storage():
+    return StorageSimulado()
+
+@pytest.fixture
+def client(storage):
+    http = httpx.Client(transport=httpx.MockTransport(storage))
+    return supabase.create_client(
+        SUPABASE_URL,
+        SUPABASE_KEY,
+        options=SyncClientOptions(httpx_client=http)
+    )
+
+def test_enviar_arquivo_pequeno_usa_url_assinada(client, storage, tmp_path):
+    arquivo = tmp_path / "grade_saida.geojson"
+    arquivo.write_bytes(b'{"type": "FeatureCollection"}')
+    
+    sb_connect.enviar_arquivo(client, arquivo, "produtos_finais/123/grade_saida.geojson")
+    
+    assert storage.objetos["produtos_finais/123/grade_saida.geojson"] == arquivo.read_bytes()
+    assert storage.uploads == {}
+
+def test_enviar_arquivo_grande_usa_upload_resumavel(client, storage, tmp_path):
+    arquivo = tmp_path / "vari.tif"
+    conteudo = bytes(range(256)) * (sb_connect.TAMANHO_BLOCO_UPLOAD // 256 + 1000)
+    arquivo.write_bytes(conteudo)
+    
+    sb_connect.enviar_arquivo(client, arquivo, "produtos_finais/123/vari.tif")
+    
+    assert storage.uploads["abc"]["tamanho"] == len(conteudo)
+    assert bytes(storage.uploads["abc"]["dados"]) == conteudo
+    assert storage.objetos == {}